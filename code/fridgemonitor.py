@@ -37,7 +37,7 @@ import json
 import math
 import os
 import signal
-from   subprocess import PIPE, Popen
+import socket
 import sys
 import threading
 import time
@@ -57,15 +57,22 @@ ENABLE_AVAILABILITY_TOPIC = True
 FIRMWARE = "1.0.3"
 CONFFILE = "fridgemonitor.conf"
 STATEFILE = "fridgemonitor.json"
+HATDIR = "/proc/device-tree/hat"  # HAT EEPROM information from device tree
 ALERT = 27                      # Pin number of alert signal on PCB
 SAVEFILEFREQ = 300              # how long to delay writing to state file
 QOS = 1                         # MQTT Quality of Service
+TELEMETRY_QOS = 0               # MQTT Quality of Service for sensor readings
 
 # Global variables
 Mqttc = None
 Mqttconnected = False
 Lock = threading.Lock()
+StateChanged = threading.Event()  # wakes main loop when Changed is set
+Republish = True                # when True publish all states, not just changes
 SaveStateTimer = None
+BeepTimer = None                # turns buzzer OFF at the end of a beep
+BuzzerLock = threading.Lock()
+SensorTimer = None
 StartTime = None
 ResetAlarmDisable = True        # when True and hour is 6PM reset Alarm Disable
 Hat_Product = ""
@@ -103,6 +110,37 @@ def getWLANMac():
     return None
   return mac.strip()
 
+def getWLANRssi():
+  # Extract signal level (dBm) from wireless statistics
+  try:
+    with open('/proc/net/wireless','r') as f:
+      for line in f:
+        fields = line.split()
+        if len(fields) > 3 and fields[0] == 'wlan0:':
+          return int(float(fields[3]))
+  except:
+    pass
+  return None
+
+def readHatInfo():
+    """Read the HAT EEPROM information from the device tree.
+
+        :returns: dictionary of HAT information strings keyed by file name.
+    """
+    hat = {}
+    # open files relative to the hat directory
+    dirfd = os.open(HATDIR, os.O_RDONLY)
+    try:
+        for name in ('product', 'vendor', 'product_id', 'product_ver', 'uuid'):
+            fd = os.open(name, os.O_RDONLY, dir_fd=dirfd)
+            try:
+                hat[name] = os.read(fd, 256).decode('utf-8').rstrip('\x00')
+            finally:
+                os.close(fd)
+    finally:
+        os.close(dirfd)
+    return hat
+
 class GracefulKiller:
     """Class to handle SIGTERM signal."""
     kill_now = False
@@ -112,12 +150,25 @@ class GracefulKiller:
 
     def exit_gracefully(self,signum, frame):
         self.kill_now = True
+        # wake up main loop so it can exit
+        StateChanged.set()
 
 def saveStateFile():
     """Save state to file."""
     global SaveState
-    with open(STATEFILE, 'w') as outfile:
-        json.dump(SaveState, outfile)
+    # state is updated in place by the main loop so it needs to be thread safe
+    with Lock:
+        data = json.dumps(SaveState).encode('utf-8')
+    # write to a temporary file and rename so a crash never leaves a
+    #   partially written state file
+    tmpfile = STATEFILE + '.tmp'
+    fd = os.open(tmpfile, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        os.write(fd, data)
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+    os.replace(tmpfile, STATEFILE)
     logging.info("Updated current state file %s.", STATEFILE)
 
 def queueSaveStateFile(state):
@@ -134,22 +185,47 @@ def queueSaveStateFile(state):
     SaveStateTimer = threading.Timer(SAVEFILEFREQ, saveStateFile)
     SaveStateTimer.start()
 
+def cancel_beep():
+    """Cancels a pending beep timer, caller must hold BuzzerLock."""
+    global BeepTimer
+    if BeepTimer is not None:
+        BeepTimer.cancel()
+        BeepTimer = None
+
 def buzzer_on():
     """Turns ON alert buzzer on Thermocouple Hat."""
-    GPIO.output(ALERT, GPIO.HIGH)
+    with BuzzerLock:
+        cancel_beep()
+        GPIO.output(ALERT, GPIO.HIGH)
 
 def buzzer_off():
     """Turns OFF alert buzzer on Thermocouple Hat."""
-    GPIO.output(ALERT, GPIO.LOW)
+    with BuzzerLock:
+        cancel_beep()
+        GPIO.output(ALERT, GPIO.LOW)
+
+def buzzer_beep_end():
+    """Turns OFF alert buzzer at the end of a beep unless it was since
+        turned ON or OFF by someone else.
+    """
+    global BeepTimer
+    with BuzzerLock:
+        if BeepTimer is threading.current_thread():
+            BeepTimer = None
+            GPIO.output(ALERT, GPIO.LOW)
 
 def buzzer_beep(beeptime):
     """Turns ON alert buzzer on Hat for a period of time in seconds.
+        Returns immediately, the buzzer is turned OFF by a timer thread.
     
         :time: Time in seconds to beep (float).
     """
-    GPIO.output(ALERT, GPIO.HIGH)
-    time.sleep(beeptime)
-    GPIO.output(ALERT, GPIO.LOW)
+    global BeepTimer
+    with BuzzerLock:
+        cancel_beep()
+        GPIO.output(ALERT, GPIO.HIGH)
+        BeepTimer = threading.Timer(beeptime, buzzer_beep_end)
+        BeepTimer.start()
 
 def measureSensors():
     """Take temperature and WiFi RSSI measurements.
@@ -160,7 +236,10 @@ def measureSensors():
         # initialize StartTime
         if not StartTime:
             StartTime = time.time()
-        # sample the temperatures (upwards of 1 sec per sensor)
+        # start conversions on all sensors at once when supported, otherwise
+        #   each sensor converts when read (upwards of 1 sec per sensor)
+        W1ThermSensor.trigger_bulk_read()
+        # sample the temperatures
         for i in range(0, TC_Count + 1):
             try:
                 # read the temperature
@@ -177,10 +256,9 @@ def measureSensors():
                 logging.exception("Error, %s sensor failed to read.", 
                     Temps[i].name)
         # determine if it is time to publish sensors
-        if (time.time() - StartTime > 
-            Config['Sensors'].getint('Sensor_Publish_Rate')):
+        if time.time() - StartTime > Sensor_Publish_Rate:
             # update StartTime to next interval
-            StartTime += Config['Sensors'].getint('Sensor_Publish_Rate')
+            StartTime += Sensor_Publish_Rate
             # do data analysis on all the sensor data
             for i in range(0, TC_Count + 1):
                 Temps[i].data_analysis()
@@ -190,54 +268,45 @@ def measureSensors():
             # publish temps
             for i in range(0, TC_Count + 1):
                 Mqttc.publish(ConfigTemp[i]['stat_t'], 
-                    f"{Temps[i].temperature:0.2F}", qos=QOS, retain=True)
+                    f"{Temps[i].temperature:0.2F}", qos=TELEMETRY_QOS,
+                    retain=True)
                 if i > 0:
                     if not math.isnan(Temps[i].average):
                         Mqttc.publish(ConfigAvg[i]['stat_t'], 
-                            f"{Temps[i].average:0.2F}", qos=QOS, retain=True)
+                            f"{Temps[i].average:0.2F}", qos=TELEMETRY_QOS,
+                            retain=True)
                     if not math.isnan(Temps[i].delta):
                         Mqttc.publish(ConfigDelta[i]['stat_t'], 
-                            f"{Temps[i].delta:0.4F}", qos=QOS, retain=True)
+                            f"{Temps[i].delta:0.4F}", qos=TELEMETRY_QOS,
+                            retain=True)
             # publish RSSI
-            if Config['Sensors'].getboolean('Enable_RSSI'):
-                # publish RSSI but first get from iwconfig
-                process = Popen(['iwconfig', 'wlan0'], stdout=PIPE)
-                output, _error = process.communicate()
-                rssi = -1000
-                for line in output.decode("utf-8").split("\n"):
-                    if "Signal level" in line:
-                        rssi = int(line.split("Signal level=")[1].split(" ")[0])
-                if (rssi > -1000):
+            if Enable_RSSI:
+                # publish RSSI but first get from wireless statistics
+                rssi = getWLANRssi()
+                if rssi is not None:
                     # RSSI was measured, time to publish
-                    Mqttc.publish(ConfigRSSI['stat_t'], str(rssi), qos=QOS,
-                        retain=True)
+                    Mqttc.publish(ConfigRSSI['stat_t'], str(rssi),
+                        qos=TELEMETRY_QOS, retain=True)
             # needs to be thread safe
             with Lock:
                 # check for state changes on TC's
                 for i in range(1, TC_Count + 1):
-                    # handle door state changes
-                    if CurState['doors_open'][i] == True:
-                        # door previously open
-                        if Temps[i].door_open == False:
-                            # door just closed
-                            NextState['doors_open'][i] = False
-                            Changed = True
-                    else:
-                        # door previously closed
-                        if Temps[i].door_open == True:
-                            # door just opened
-                            NextState['doors_open'][i] = True
-                            Changed = True
+                    # handle door state changes, compare against the pending
+                    #   state so an open and close while not published
+                    #   (e.g. MQTT disconnected) is not left stuck open
+                    if NextState['doors_open'][i] != Temps[i].door_open:
+                        NextState['doors_open'][i] = Temps[i].door_open
+                        Changed = True
                     # update alarm states (changed will be handled later)
                     NextState['alarms'][i] = Temps[i].alarm                            
                 # logical OR of all alarms (only on TC's)
-                NextState['alarm'] = False
-                for i in range(1, TC_Count + 1):
-                    if NextState['alarms'][i] == True:
-                        NextState['alarm'] = True
+                NextState['alarm'] = any(NextState['alarms'][1:TC_Count + 1])
                 # determine alarm change and update alarm status
                 if CurState['alarm'] !=  NextState['alarm']:
                     Changed = True
+                # wake up main loop to handle state changes
+                if Changed:
+                    StateChanged.set()
     except:
         # log the exception
         logging.exception("Failed to measure sensors.")
@@ -247,20 +316,21 @@ def mqtt_on_message(mqttc, obj, msg):
         Executed in a thread different from main thread.
     """
     global Changed, CurState, NextState
-    if (msg.topic == ConfigAlarmDisable['cmd_t']):
+    if msg.topic == CmdTopicAlarmDisable:
         # received an Alarm Disable command
-        payload = msg.payload.decode("utf-8").strip()
+        payload = msg.payload.decode("utf-8").strip().lower()
         # needs to be thread safe
         with Lock:        
-            if payload.lower() == 'on':
+            if payload == 'on':
                 NextState['alarm_disable'] = True
-            elif payload.lower() == 'off':
+            elif payload == 'off':
                 NextState['alarm_disable'] = False
             else:
                 logging.warning("Warning, unknown Alarm Disable " +
                     "command payload '%s'.",payload)
             if CurState['alarm_disable'] != NextState['alarm_disable']:
                 Changed = True
+                StateChanged.set()
     else:
         logging.warning("Warning, unknown command topic '%s', " +
             "with payload '%s'.", msg.topic, msg.payload.decode("utf-8"))
@@ -269,78 +339,86 @@ def mqtt_on_connect(mqttc, userdata, flags, rc):
     """Handle MQTT connection events.
         Executed in a thread different from main thread.
     """
-    global Changed, Mqttconnected
+    global Changed, Mqttconnected, Republish
     if rc == 0:
         # connection was successful
         logging.info("Connected to MQTT broker: mqtt://%s:%s.",
             mqttc._host, mqttc._port)
+        # disable Nagle's algorithm so small publishes are not delayed
+        sock = mqttc.socket()
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
         # publish node configs if discovery is on
-        if Config.getboolean('Home Assistant', 'Discovery_Enabled'):
+        if Discovery_Enabled:
             try:
                 # discovery is enabled so publish config data
-                mqttc.publish("/".join([TopicAlarmDisable, 'config']),
-                    payload=json.dumps(ConfigAlarmDisable), qos=QOS, 
+                mqttc.publish(ConfigTopicAlarmDisable,
+                    payload=ConfigPayloadAlarmDisable, qos=QOS, 
                     retain=True)
-                mqttc.publish("/".join([TopicAlarm, 'config']),
-                    payload=json.dumps(ConfigAlarm), qos=QOS, retain=True)
-                if Config['Sensors'].getboolean('Enable_RSSI'):
-                    mqttc.publish("/".join([TopicRSSI, 'config']),
-                        payload=json.dumps(ConfigRSSI), qos=QOS, retain=True)
+                mqttc.publish(ConfigTopicAlarm,
+                    payload=ConfigPayloadAlarm, qos=QOS, retain=True)
+                if Enable_RSSI:
+                    mqttc.publish(ConfigTopicRSSI,
+                        payload=ConfigPayloadRSSI, qos=QOS, retain=True)
                 else:
-                    mqttc.publish("/".join([TopicRSSI, 'config']),
+                    mqttc.publish(ConfigTopicRSSI,
                         "", qos=QOS, retain=True)
                 for i in range(0, 4):
                     if i <= TC_Count:
                         # set defined temperature config topics
-                        mqttc.publish("/".join([TopicTemp[i], 'config']),
-                            payload=json.dumps(ConfigTemp[i]), qos=QOS, 
+                        mqttc.publish(ConfigTopicTemp[i],
+                            payload=ConfigPayloadTemp[i], qos=QOS, 
                             retain=True)
                     else:
                         # clear undefined config topics
-                        mqttc.publish("/".join([TopicTemp[i], 'config']),
+                        mqttc.publish(ConfigTopicTemp[i],
                             payload="", qos=QOS, retain=False)
                     # no data anlysis nodes on monitor temperature sensor
                     if i > 0:
                         if i <= TC_Count:
                             # set door config topics
-                            mqttc.publish("/".join([TopicDoor[i], 'config']),
-                                payload=json.dumps(ConfigDoor[i]), qos=QOS, 
+                            mqttc.publish(ConfigTopicDoor[i],
+                                payload=ConfigPayloadDoor[i], qos=QOS, 
                                 retain=True)
                             # set defined data analysis config topics
-                            mqttc.publish("/".join([TopicAvg[i], 'config']),
-                                payload=json.dumps(ConfigAvg[i]), qos=QOS,
+                            mqttc.publish(ConfigTopicAvg[i],
+                                payload=ConfigPayloadAvg[i], qos=QOS,
                                 retain=True)
-                            mqttc.publish("/".join([TopicDelta[i], 'config']),
-                                payload=json.dumps(ConfigDelta[i]), qos=QOS, 
+                            mqttc.publish(ConfigTopicDelta[i],
+                                payload=ConfigPayloadDelta[i], qos=QOS, 
                                 retain=True)
                         else:
                             # clear undefined config topics
-                            mqttc.publish("/".join([TopicDoor[i], 'config']),
+                            mqttc.publish(ConfigTopicDoor[i],
                                 payload="", qos=QOS, retain=True)
-                            mqttc.publish("/".join([TopicAvg[i], 'config']),
+                            mqttc.publish(ConfigTopicAvg[i],
                                 payload="", qos=QOS, retain=True)
-                            mqttc.publish("/".join([TopicDelta[i], 'config']),
+                            mqttc.publish(ConfigTopicDelta[i],
                                 payload="", qos=QOS, retain=True)
             except:
                 logging.exception("Failed to publish config topics.")
         else:
             # discovery is disabled so clear temperature config topics
-            mqttc.publish("/".join([TopicAlarmDisable, 'config']),
+            mqttc.publish(ConfigTopicAlarmDisable,
                 payload="", qos=QOS, retain=False)
-            mqttc.publish("/".join([TopicRSSI, 'config']),
+            mqttc.publish(ConfigTopicRSSI,
                 payload="", qos=QOS, retain=False)
             for i in range(0, 4):
-                mqttc.publish("/".join([TopicTemp[i], 'config']),
+                mqttc.publish(ConfigTopicTemp[i],
                     payload="", qos=QOS, retain=False)
         # subscribe to Alarm Disable Switch command topic
-        mqttc.subscribe(ConfigAlarmDisable['cmd_t'])
+        mqttc.subscribe(CmdTopicAlarmDisable)
         # update availability
         mqttc.publish(TopicAvailability, payload=PayloadAvailable, 
             qos=QOS, retain=True)
-        # indicate we are now connected
-        Mqttconnected = True
-        # force update of states
-        Changed = True
+        # needs to be thread safe, the main loop clears these flags
+        with Lock:
+            # indicate we are now connected
+            Mqttconnected = True
+            # force update of all states
+            Republish = True
+            Changed = True
+            StateChanged.set()
     else:
         # connection failed
         if rc == 5:
@@ -430,24 +508,22 @@ try:
         logging.warning("Warning, config file 'Sensor_Publish_Rate' less " + 
             "than 60 seconds. Set to 60.")
     Config['Sensors']['Sensor_Publish_Rate'] = str(Sensor_Publish_Rate)
+    # cache other settings used every publish cycle or connection
+    Enable_RSSI = Config['Sensors'].getboolean('Enable_RSSI')
+    Discovery_Enabled = Config['Home Assistant'].getboolean('Discovery_Enabled')
 
     # verify the pHat exists
-    if not os.path.isdir("/proc/device-tree/hat"):
+    if not os.path.isdir(HATDIR):
         logging.error("Error, No Hat detected.")
         sys.exit(1)     
 
     # get hat information
-    with open("/proc/device-tree/hat/product", 'r') as f:
-        Hat_Product = f.readline(100).rstrip('\x00')
-    with open("/proc/device-tree/hat/vendor", 'r') as f:
-        hat_vendor = f.readline(100).rstrip('\x00')
-    with open("/proc/device-tree/hat/product_id", 'r') as f:
-        hat_productid = f.readline(100).rstrip('\x00')
-    with open("/proc/device-tree/hat/product_ver", 'r') as f:
-        hat_revision = f.readline(100).rstrip('\x00')
-        hat_revision = int(hat_revision, 16)
-    with open("/proc/device-tree/hat/uuid", 'r') as f:
-        hat_uuid = f.read()
+    hat_info = readHatInfo()
+    Hat_Product = hat_info['product']
+    hat_vendor = hat_info['vendor']
+    hat_productid = hat_info['product_id']
+    hat_revision = int(hat_info['product_ver'], 16)
+    hat_uuid = hat_info['uuid']
 
     # hat is present make sure it is the right one
     if not Hat_Product == "Raspberry Pi Thermocouple pHat":
@@ -489,14 +565,9 @@ try:
         logging.error("Error, failed to discover board DS18S20.")
         sys.exit(1)
     # log sensor information
-    logging.info("TC1 is '%s' is ID=%s.",
-        Config['Sensors']['TC1_Name'], TC[1].id)
-    if TC_Count > 1:        
-        logging.info("TC2 is '%s' is ID=%s.",
-            Config['Sensors']['TC2_Name'], TC[2].id)
-    if TC_Count > 2:        
-        logging.info("TC3 is '%s' is ID=%s.",
-            Config['Sensors']['TC3_Name'], TC[3].id)
+    for i in range(1, TC_Count + 1):
+        logging.info("TC%s is '%s' is ID=%s.",
+            i, Config['Sensors'][f"TC{i}_Name"], TC[i].id)
 
     # load current state file
     try:
@@ -519,8 +590,14 @@ try:
     CurState['alarms'] = [False, False, False, False]
     CurState['doors_open'] = [False, False, False, False]
     CurState['alarm'] = False
-    # on startup NextState is the same as CurState
-    NextState = CurState.copy()
+    # on startup NextState is the same as CurState, lists must not be shared
+    #   because CurState is updated in place from NextState
+    NextState = {
+        'alarm_disable': CurState['alarm_disable'],
+        'doors_open': CurState['doors_open'].copy(),
+        'alarms': CurState['alarms'].copy(),
+        'alarm': CurState['alarm'],
+    }
 
     # since this is a first run when should update the MQTT server states
     Changed = True
@@ -571,6 +648,7 @@ try:
         'uniq_id': UniqueId+'00',
         'dev': HA_device,
     }
+    CmdTopicAlarmDisable = ConfigAlarmDisable['cmd_t']
     # add availability topic if configured
     if ENABLE_AVAILABILITY_TOPIC == True:
         ConfigAlarmDisable['avty_t'] = TopicAvailability
@@ -603,187 +681,101 @@ try:
     if ENABLE_AVAILABILITY_TOPIC == True:
         ConfigRSSI['avty_t'] = TopicAvailability
 
-    # create Temperature Sensor Home Assistant Discovery Config
-    TopicTemp[0] = "/".join([Config['Home Assistant']['Discovery_Prefix'], 
-        'sensor', Config['Home Assistant']['Node_ID'], 'temperature'])
-    ConfigTemp[0] = {
-        'name': Config['Home Assistant']['Node_Name'] + " Temperature",
-        'stat_t': "/".join([TopicTemp[0], 'state']),
-        'unit_of_meas': '°C',
-        'uniq_id': UniqueId+'03',
-        'dev': HA_device,
-    }
-    # add availability topic if configured
-    if ENABLE_AVAILABILITY_TOPIC == True:
-        ConfigTemp[0].update({'avty_t': TopicAvailability})
-
-    # create TC1 Temperature Sensor Home Assistant Discovery Config
-    TopicTemp[1] = "/".join([Config['Home Assistant']['Discovery_Prefix'], 
-        'sensor', Config['Home Assistant']['Node_ID'], 'TC1_temperature'])
-    ConfigTemp[1] = {
-        'name': Config['Sensors']['TC1_Name'] + " Temperature",
-        'stat_t': "/".join([TopicTemp[1], 'state']),
-        'unit_of_meas': '°C',
-        'uniq_id': UniqueId+'04',
-        'dev': HA_device,
-    }
-    # add availability topic if configured
-    if ENABLE_AVAILABILITY_TOPIC == True:        
-        ConfigTemp[1].update({'avty_t': TopicAvailability})
-
-    # create TC1 Average Sensor Home Assistant Discovery Config
-    TopicAvg[1] = "/".join([Config['Home Assistant']['Discovery_Prefix'], 
-        'sensor', Config['Home Assistant']['Node_ID'], 'TC1_average'])
-    ConfigAvg[1] = {
-        'name': Config['Sensors']['TC1_Name'] + " Average",
-        'stat_t': "/".join([TopicAvg[1], 'state']),
-        'unit_of_meas': '°C',
-        'uniq_id': UniqueId+'05',
-        'dev': HA_device,
-    }
-    # add availability topic if configured
-    if ENABLE_AVAILABILITY_TOPIC == True:        
-        ConfigAvg[1].update({'avty_t': TopicAvailability})
-
-    # create TC1 Delta Sensor Home Assistant Discovery Config
-    TopicDelta[1] = "/".join([Config['Home Assistant']['Discovery_Prefix'], 
-        'sensor', Config['Home Assistant']['Node_ID'], 'TC1_delta'])
-    ConfigDelta[1] = {
-        'name': Config['Sensors']['TC1_Name'] + " Delta",
-        'stat_t': "/".join([TopicDelta[1], 'state']),
-        'unit_of_meas': '°C/min',
-        'uniq_id': UniqueId+'06',
-        'dev': HA_device,
-    }
-    # add availability topic if configured
-    if ENABLE_AVAILABILITY_TOPIC == True:        
-        ConfigDelta[1].update({'avty_t': TopicAvailability})
-
-    # create TC1 Door binary_sensor Home Assistant Discovery Config
-    TopicDoor[1] = "/".join([Config['Home Assistant']['Discovery_Prefix'], 
-        'binary_sensor', Config['Home Assistant']['Node_ID'], 'TC1_door'])
-    ConfigDoor[1] = {
-        'name': Config['Sensors']['TC1_Name'] + " Door",
-        'stat_t': "/".join([TopicDoor[1], 'state']),
-        'dev_cla': "door",
-        'uniq_id': UniqueId+'07',
-        'dev': HA_device,
-    }
-    # add availability topic if configured
-    if ENABLE_AVAILABILITY_TOPIC == True:
-        ConfigDoor[1].update({'avty_t': TopicAvailability})
-
-    # create TC2 Temperature Sensor Home Assistant Discovery Config
-    TopicTemp[2] = "/".join([Config['Home Assistant']['Discovery_Prefix'], 
-        'sensor', Config['Home Assistant']['Node_ID'], 'TC2_temperature'])
-    ConfigTemp[2] = {
-        'name': Config['Sensors']['TC2_Name'] + " Temperature",
-        'stat_t': "/".join([TopicTemp[2], 'state']),
-        'unit_of_meas': '°C',
-        'uniq_id': UniqueId+'08',
-        'dev': HA_device,
-    }
-    # add availability topic if configured
-    if ENABLE_AVAILABILITY_TOPIC == True:
-        ConfigTemp[2].update({'avty_t': TopicAvailability})
-
-    # create TC2 Average Sensor Home Assistant Discovery Config
-    TopicAvg[2] = "/".join([Config['Home Assistant']['Discovery_Prefix'], 
-        'sensor', Config['Home Assistant']['Node_ID'], 'TC2_average'])
-    ConfigAvg[2] = {
-        'name': Config['Sensors']['TC2_Name'] + " Average",
-        'stat_t': "/".join([TopicAvg[2], 'state']),
-        'unit_of_meas': '°C',
-        'uniq_id': UniqueId+'09',
-        'dev': HA_device,
-    }
-    # add availability topic if configured
-    if ENABLE_AVAILABILITY_TOPIC == True:        
-        ConfigAvg[2].update({'avty_t': TopicAvailability})
-
-    # create TC2 Delta Sensor Home Assistant Discovery Config
-    TopicDelta[2] = "/".join([Config['Home Assistant']['Discovery_Prefix'], 
-        'sensor', Config['Home Assistant']['Node_ID'], 'TC2_delta'])
-    ConfigDelta[2] = {
-        'name': Config['Sensors']['TC2_Name'] + " Delta",
-        'stat_t': "/".join([TopicDelta[2], 'state']),
-        'unit_of_meas': '°C/min',
-        'uniq_id': UniqueId+'0A',
-        'dev': HA_device,
-    }
-    # add availability topic if configured
-    if ENABLE_AVAILABILITY_TOPIC == True:        
-        ConfigDelta[2].update({'avty_t': TopicAvailability})
-
-    # create TC2 Door binary_sensor Home Assistant Discovery Config
-    TopicDoor[2] = "/".join([Config['Home Assistant']['Discovery_Prefix'], 
-        'binary_sensor', Config['Home Assistant']['Node_ID'], 'TC2_door'])
-    ConfigDoor[2] = {
-        'name': Config['Sensors']['TC2_Name'] + " Door",
-        'stat_t': "/".join([TopicDoor[2], 'state']),
-        'dev_cla': "door",
-        'uniq_id': UniqueId+'0B',
-        'dev': HA_device,
-    }
-    # add availability topic if configured
-    if ENABLE_AVAILABILITY_TOPIC == True:
-        ConfigDoor[2].update({'avty_t': TopicAvailability})
-
-    # create TC3 Temperature Sensor Home Assistant Discovery Config
-    TopicTemp[3] = "/".join([Config['Home Assistant']['Discovery_Prefix'], 
-        'sensor', Config['Home Assistant']['Node_ID'], 'TC3_temperature'])
-    ConfigTemp[3] = {
-        'name': Config['Sensors']['TC3_Name'] + " Temperature",
-        'stat_t': "/".join([TopicTemp[3], 'state']),
-        'unit_of_meas': '°C',
-        'uniq_id': UniqueId+'0C',
-        'dev': HA_device,
-    }
-    # add availability topic if configured
-    if ENABLE_AVAILABILITY_TOPIC == True:
-        ConfigTemp[3].update({'avty_t': TopicAvailability})
-    
-    # create TC3 Average Sensor Home Assistant Discovery Config
-    TopicAvg[3] = "/".join([Config['Home Assistant']['Discovery_Prefix'], 
-        'sensor', Config['Home Assistant']['Node_ID'], 'TC3_average'])
-    ConfigAvg[3] = {
-        'name': Config['Sensors']['TC3_Name'] + " Average",
-        'stat_t': "/".join([TopicAvg[3], 'state']),
-        'unit_of_meas': '°C',
-        'uniq_id': UniqueId+'0D',
-        'dev': HA_device,
-    }
-    # add availability topic if configured
-    if ENABLE_AVAILABILITY_TOPIC == True:        
-        ConfigAvg[3].update({'avty_t': TopicAvailability})
-
-    # create TC3 Delta Sensor Home Assistant Discovery Config
-    TopicDelta[3] = "/".join([Config['Home Assistant']['Discovery_Prefix'], 
-        'sensor', Config['Home Assistant']['Node_ID'], 'TC3_delta'])
-    ConfigDelta[3] = {
-        'name': Config['Sensors']['TC3_Name'] + " Delta",
-        'stat_t': "/".join([TopicDelta[3], 'state']),
-        'unit_of_meas': '°C/min',
-        'uniq_id': UniqueId+'0E',
-        'dev': HA_device,
-    }
-    # add availability topic if configured
-    if ENABLE_AVAILABILITY_TOPIC == True:        
-        ConfigDelta[3].update({'avty_t': TopicAvailability})
-
-    # create TC3 Door binary_sensor Home Assistant Discovery Config
-    TopicDoor[3] = "/".join([Config['Home Assistant']['Discovery_Prefix'], 
-        'binary_sensor', Config['Home Assistant']['Node_ID'], 'TC3_door'])
-    ConfigDoor[3] = {
-        'name': Config['Sensors']['TC3_Name'] + " Door",
-        'stat_t': "/".join([TopicDoor[3], 'state']),
-        'dev_cla': "door",
-        'uniq_id': UniqueId+'0F',
-        'dev': HA_device,
-    }
-    # add availability topic if configured
-    if ENABLE_AVAILABILITY_TOPIC == True:
-        ConfigDoor[3].update({'avty_t': TopicAvailability})
+    # create Temperature, Average, Delta and Door Home Assistant Discovery
+    #   Configs for the board sensor (0) and thermocouples TC1-TC3 (1-3)
+    prefix = Config['Home Assistant']['Discovery_Prefix']
+    node_id = Config['Home Assistant']['Node_ID']
+    for i in range(0, 4):
+        if i == 0:
+            # board temperature sensor
+            name = Config['Home Assistant']['Node_Name']
+            slug = ''
+            uniq_id = 0x03
+        else:
+            # each thermocouple uses 4 unique ids starting at 0x04
+            name = Config['Sensors'][f"TC{i}_Name"]
+            slug = f"TC{i}_"
+            uniq_id = 4 * i
+        # create Temperature Sensor Home Assistant Discovery Config
+        TopicTemp[i] = "/".join([prefix, 'sensor', node_id, 
+            slug + 'temperature'])
+        ConfigTemp[i] = {
+            'name': name + " Temperature",
+            'stat_t': "/".join([TopicTemp[i], 'state']),
+            'unit_of_meas': '°C',
+            'uniq_id': UniqueId + f"{uniq_id:02X}",
+            'dev': HA_device,
+        }
+        # add availability topic if configured
+        if ENABLE_AVAILABILITY_TOPIC == True:
+            ConfigTemp[i].update({'avty_t': TopicAvailability})
+        # no data analysis nodes on board temperature sensor
+        if i == 0:
+            continue
+
+        # create TC Average Sensor Home Assistant Discovery Config
+        TopicAvg[i] = "/".join([prefix, 'sensor', node_id, slug + 'average'])
+        ConfigAvg[i] = {
+            'name': name + " Average",
+            'stat_t': "/".join([TopicAvg[i], 'state']),
+            'unit_of_meas': '°C',
+            'uniq_id': UniqueId + f"{uniq_id + 1:02X}",
+            'dev': HA_device,
+        }
+        # add availability topic if configured
+        if ENABLE_AVAILABILITY_TOPIC == True:
+            ConfigAvg[i].update({'avty_t': TopicAvailability})
+
+        # create TC Delta Sensor Home Assistant Discovery Config
+        TopicDelta[i] = "/".join([prefix, 'sensor', node_id, slug + 'delta'])
+        ConfigDelta[i] = {
+            'name': name + " Delta",
+            'stat_t': "/".join([TopicDelta[i], 'state']),
+            'unit_of_meas': '°C/min',
+            'uniq_id': UniqueId + f"{uniq_id + 2:02X}",
+            'dev': HA_device,
+        }
+        # add availability topic if configured
+        if ENABLE_AVAILABILITY_TOPIC == True:
+            ConfigDelta[i].update({'avty_t': TopicAvailability})
+
+        # create TC Door binary_sensor Home Assistant Discovery Config
+        TopicDoor[i] = "/".join([prefix, 'binary_sensor', node_id, 
+            slug + 'door'])
+        ConfigDoor[i] = {
+            'name': name + " Door",
+            'stat_t': "/".join([TopicDoor[i], 'state']),
+            'dev_cla': "door",
+            'uniq_id': UniqueId + f"{uniq_id + 3:02X}",
+            'dev': HA_device,
+        }
+        # add availability topic if configured
+        if ENABLE_AVAILABILITY_TOPIC == True:
+            ConfigDoor[i].update({'avty_t': TopicAvailability})
+
+    # create discovery config topics
+    ConfigTopicAlarmDisable = "/".join([TopicAlarmDisable, 'config'])
+    ConfigTopicAlarm = "/".join([TopicAlarm, 'config'])
+    ConfigTopicRSSI = "/".join([TopicRSSI, 'config'])
+    ConfigTopicTemp = ["/".join([topic, 'config']) for topic in TopicTemp]
+    ConfigTopicAvg = [None] + ["/".join([topic, 'config']) 
+        for topic in TopicAvg[1:]]
+    ConfigTopicDelta = [None] + ["/".join([topic, 'config']) 
+        for topic in TopicDelta[1:]]
+    ConfigTopicDoor = [None] + ["/".join([topic, 'config']) 
+        for topic in TopicDoor[1:]]
+
+    # serialize discovery configs once, they do not change after startup
+    ConfigPayloadAlarmDisable = json.dumps(ConfigAlarmDisable)
+    ConfigPayloadAlarm = json.dumps(ConfigAlarm)
+    ConfigPayloadRSSI = json.dumps(ConfigRSSI)
+    ConfigPayloadTemp = [json.dumps(config) for config in ConfigTemp]
+    ConfigPayloadAvg = [None] + [json.dumps(config) 
+        for config in ConfigAvg[1:]]
+    ConfigPayloadDelta = [None] + [json.dumps(config) 
+        for config in ConfigDelta[1:]]
+    ConfigPayloadDoor = [None] + [json.dumps(config) 
+        for config in ConfigDoor[1:]]
 
     # setup MQTT
     Mqttc = mqtt.Client()
@@ -814,34 +806,17 @@ try:
             time.sleep(10)          # sleep for 10 seconds before retrying
 
     # create TempData arrays
-    Temps = [None] * (TC_Count + 1)
-    # no door sensing on the board temperature sensor
-    Temps[0] = TempData(Config['Home Assistant']['Node_Name'], "", 
-        10000.0, 1000.0, 900.0, 800.0)
-
-    # TC1 is always used
-    Temps[1] = TempData(Config['Sensors']['TC1_Name'], 'TC1.dat',
-        Config['Sensors'].getfloat('TC1_Delta_Rise'), 
-        Config['Sensors'].getfloat('TC1_Alarm_Max_Temp'),
-        Config['Sensors'].getfloat('TC1_Alarm_Set_Time'),
-        Config['Sensors'].getfloat('TC1_Alarm_Set_Temp'),
-        Config['Sensors'].getfloat('TC1_Alarm_Reset_Temp'))
-    # TC2 may not be used
-    if TC_Count > 1:
-        Temps[2] = TempData(Config['Sensors']['TC2_Name'], 'TC2.dat',
-        Config['Sensors'].getfloat('TC2_Delta_Rise'), 
-        Config['Sensors'].getfloat('TC2_Alarm_Max_Temp'),
-        Config['Sensors'].getfloat('TC2_Alarm_Set_Time'),
-        Config['Sensors'].getfloat('TC2_Alarm_Set_Temp'),
-        Config['Sensors'].getfloat('TC2_Alarm_Reset_Temp'))
-    # TC3 may not be used
-    if TC_Count > 2:
-        Temps[3] = TempData(Config['Sensors']['TC3_Name'],'TC3.dat',
-        Config['Sensors'].getfloat('TC3_Delta_Rise'), 
-        Config['Sensors'].getfloat('TC3_Alarm_Max_Temp'),
-        Config['Sensors'].getfloat('TC3_Alarm_Set_Time'),
-        Config['Sensors'].getfloat('TC3_Alarm_Set_Temp'),
-        Config['Sensors'].getfloat('TC3_Alarm_Reset_Temp'))
+    #   no door sensing on the board temperature sensor
+    Temps = [TempData(Config['Home Assistant']['Node_Name'], "", 
+        10000.0, 1000.0, 900.0, 800.0)]
+    # TC1 is always used, TC2 and TC3 may not be used
+    Temps += [TempData(Config['Sensors'][f"TC{i}_Name"], f"TC{i}.dat",
+        Config['Sensors'].getfloat(f"TC{i}_Delta_Rise"), 
+        Config['Sensors'].getfloat(f"TC{i}_Alarm_Max_Temp"),
+        Config['Sensors'].getfloat(f"TC{i}_Alarm_Set_Time"),
+        Config['Sensors'].getfloat(f"TC{i}_Alarm_Set_Temp"),
+        Config['Sensors'].getfloat(f"TC{i}_Alarm_Reset_Temp"))
+        for i in range(1, TC_Count + 1)]
 
     # grab SIGTERM to shutdown gracefully
     killer = GracefulKiller()
@@ -850,11 +825,14 @@ try:
     Mqttc.loop_start()
 
     # start the background measure temperature timer
-    sensorTimer = InfiniteTimer(5, measureSensors, name="Sensor Timer")
-    sensorTimer.start()
+    SensorTimer = InfiniteTimer(5, measureSensors, name="Sensor Timer")
+    SensorTimer.start()
 
     # loop forever looking for state changes
     while True:
+        # wait for a state change, timeout allows the 6PM check below
+        StateChanged.wait(timeout=60)
+        StateChanged.clear()
         # needs to be thread safe
         with Lock:
             # handle re-enabling alarms based on current time
@@ -871,33 +849,43 @@ try:
             # look for Changed but only if connected
             if Changed and Mqttconnected:
                 try:
-                    # create payload for alarm disabled state
-                    if NextState['alarm_disable']:
-                        payload = 'ON'
-                    else:
-                        payload = 'OFF'
-                    # publish the Alarm Disable state
-                    Mqttc.publish(ConfigAlarmDisable['stat_t'], 
-                        payload=payload, qos=QOS, retain=True)
-                    # create payload for alarm state, and update alert buzzer
-                    if NextState['alarm'] and not NextState['alarm_disable']:
+                    # publish the Alarm Disable state only when changed
+                    if (Republish or CurState['alarm_disable'] != 
+                        NextState['alarm_disable']):
+                        if NextState['alarm_disable']:
+                            payload = 'ON'
+                        else:
+                            payload = 'OFF'
+                        Mqttc.publish(ConfigAlarmDisable['stat_t'], 
+                            payload=payload, qos=QOS, retain=True)
+                    # update alert buzzer
+                    cur_alarm = (CurState['alarm'] and 
+                        not CurState['alarm_disable'])
+                    next_alarm = (NextState['alarm'] and 
+                        not NextState['alarm_disable'])
+                    if next_alarm:
                         buzzer_on()
-                        payload = 'ON'
                     else:
                         buzzer_off()
-                        payload = 'OFF'
-                    # publish the Alarm state
-                    Mqttc.publish(ConfigAlarm['stat_t'], payload=payload,
-                        qos=QOS, retain=True)
-                    # publish Door Status 
-                    for i in range(1, TC_Count + 1):
-                        if NextState['doors_open'][i]:
+                    # publish the Alarm state only when changed
+                    if Republish or cur_alarm != next_alarm:
+                        if next_alarm:
                             payload = 'ON'
                         else:
                             payload = 'OFF'
-                        # publish the Door state
-                        Mqttc.publish(ConfigDoor[i]['stat_t'], payload=payload,
+                        Mqttc.publish(ConfigAlarm['stat_t'], payload=payload,
                             qos=QOS, retain=True)
+                    # publish Door Status 
+                    for i in range(1, TC_Count + 1):
+                        # publish the Door state only when changed
+                        if (Republish or CurState['doors_open'][i] != 
+                            NextState['doors_open'][i]):
+                            if NextState['doors_open'][i]:
+                                payload = 'ON'
+                            else:
+                                payload = 'OFF'
+                            Mqttc.publish(ConfigDoor[i]['stat_t'], 
+                                payload=payload, qos=QOS, retain=True)
                         # check for Door Opening
                         if (not CurState['doors_open'][i] and 
                             NextState['doors_open'][i]):
@@ -948,17 +936,25 @@ try:
                     # always the state is no longer changed
                     #   even if there was an exception
                     Changed = False
-                    # next state is now current state (copy dictionary)
-                    CurState = NextState.copy()
+                    Republish = False
+                    # next state is now current state (update in place)
+                    CurState['alarm_disable'] = NextState['alarm_disable']
+                    CurState['doors_open'][:] = NextState['doors_open']
+                    CurState['alarms'][:] = NextState['alarms']
+                    CurState['alarm'] = NextState['alarm']
 
         # did we receive a signal to exit?
         if killer.kill_now:
             break
 
-        # sleep for a bit
-        time.sleep(0.1)
-
 finally:
+    # stop measuring sensors
+    if SensorTimer is not None and SensorTimer.is_alive():
+        SensorTimer.stop()
+        # let a measurement in progress finish its publishes and data file
+        #   writes before going offline
+        SensorTimer.join(timeout=10)
+
     # shutdown MQTT gracefully
     if Mqttc is not None:
         # set availability to offline
@@ -22,20 +22,34 @@
 # THE SOFTWARE.
 #
 from   collections import deque
-from   datetime import datetime
 import itertools
 import logging
 import math
+from   operator import itemgetter
 import pickle
+import time
 
 # logging.basicConfig(format='Fridge Monitor: %(message)s', 
 #   level=logging.DEBUG)
 # logger for this module
 #logger = logging.getLogger(__name__)
 
-# Ordinal number replacement 1, 2, 3, 4 -> 1st, 2nd, 3rd, 4th
-ordinal = lambda n: "%d%s" % (n, 
-    "tsnrhtdd"[(math.floor(n/10)%10!=1)*(n%10<4)*n%10::4])
+# Maximum number of frequent samples kept (57 seconds worth)
+SAMPLES_MAX = 60
+# Maximum number of 1 minute samples kept (24 hours worth)
+SAMPLES_1MIN_MAX = 1500
+# Age in seconds at which 1 minute samples are dropped (24 hours)
+WINDOW_24HR = 24 * 60 * 60 - 30
+
+# Ordinal number suffixes indexed by last digit
+ORDINAL_SUFFIX = ("th", "st", "nd", "rd", "th", "th", "th", "th", "th", "th")
+
+def ordinal(n):
+    """Ordinal number replacement 1, 2, 3, 4 -> 1st, 2nd, 3rd, 4th"""
+    if 11 <= n % 100 <= 13:
+        # 11th, 12th and 13th are exceptions
+        return "%dth" % n
+    return "%d%s" % (n, ORDINAL_SUFFIX[n % 10])
 
 class TempData:
     """Keep track of temperature sensor data over time."""
@@ -48,22 +62,34 @@ class TempData:
         self._delta_rise = delta_rise
         # local copy of alarm max temperature to instantly set the alarm in °C
         self._alarm_max_temp = alarm_max_temp
-        # local copy of alarm set time in minutes
-        self._alarm_set_time = alarm_set_time
+        # local copy of alarm set time converted from minutes to seconds
+        self._alarm_set_seconds = alarm_set_time * 60.0
         # local copy of alarm set temperature in °C
         self._alarm_set_temp = alarm_set_temp
         # local copy of alarm reset temperature in °C
         self._alarm_reset_temp = alarm_reset_temp
         # local copy of file name used to save temperature data to disk
         self._file_name = file_name
+        # start with no data
+        self._clear()
         # load the file if specified
         if file_name != "":
             self.load_file()
-            return
+
+    def __len__(self):
+        """Returns the number of stored 1 minute samples."""
+        return len(self._samples_1min)
+
+    def _clear(self):
+        """Reset all temperature data and states."""
         # create empty list for frequent samples
-        self._samples = deque()
+        self._samples = deque(maxlen=SAMPLES_MAX)
+        # running sum of frequent sample temperatures
+        self._sum = 0.0
         # create empty list for 1 minute samples
-        self._samples_1min = deque()
+        self._samples_1min = deque(maxlen=SAMPLES_1MIN_MAX)
+        # running sum of 1 minute sample temperatures
+        self._sum_1min = 0.0
         # alarm state
         self._alarm = False
         # time temperature went above alarm set temp
@@ -80,113 +106,126 @@ class TempData:
         #   to settle down
         self._open = False
 
-    def __len__(self):
-        """Returns the number of stored 1 minute samples."""
-        return len(self._samples_1min)
-
     def append(self, temp):
         """Add temperature sample to data store."""
         # remove samples that are too old (right side)
-        now = datetime.now().timestamp()
-        while len(self._samples) > 0 and now - self._samples[-1][0] >= 57:
-            self._samples.pop()
-        # force temp to float
-        temp = float(temp)
+        now = time.time()
+        if self._samples and now - self._samples[0][0] >= 57:
+            # even the newest sample is too old, drop them all at once
+            self._samples.clear()
+        while self._samples and now - self._samples[-1][0] >= 57:
+            self._sum -= self._samples.pop()[1]
+        # an empty queue resets the running sum to avoid drift
+        if not self._samples:
+            self._sum = 0.0
         # throw out unknown temps
-        if temp == None:
-            logging.error(f"Error, {self._name} append None thrown out.")
+        if temp is None:
+            logging.error("Error, %s append None thrown out.", self._name)
             return
+        # force temp to float
+        temp = float(temp)
         if math.isnan(temp):
-            logging.error(f"Error, {self._name} append NaN thrown out.")
+            logging.error("Error, %s append NaN thrown out.", self._name)
             return
         # try to eliminate noisy samples 
-        if len(self._samples) > 0:
+        if self._samples:
             delta = temp - self._samples[0][1]
             if abs(delta) >= 3.0:
                 if self._noisy <= 3:
                     # not too many noisy samples in a row
                     self._noisy += 1
-                    logging.warning(f"Warning, {self._name} dropped " + 
-                        f"{ordinal(self._noisy)} noisy " +
-                        f"sample. Delta = {delta:0.2f}°C.")
+                    logging.warning("Warning, %s dropped %s noisy sample. " +
+                        "Delta = %0.2f°C.", self._name, ordinal(self._noisy),
+                        delta)
                     return
                 else:
                     # too many noisy samples in a row
-                    logging.warning(f"Warning, {self._name} appended 4th " +
-                        f"noisy sample. Delta = {delta:0.2f}°C.")
+                    logging.warning("Warning, %s appended 4th noisy " +
+                        "sample. Delta = %0.2f°C.", self._name, delta)
         # appending a sample means there are no more noisy samples
         self._noisy = 0
         # create the next sample
-        sample = [now, temp]
+        sample = (now, temp)
+        # a full queue drops its oldest sample when appending
+        if len(self._samples) == SAMPLES_MAX:
+            self._sum -= self._samples[-1][1]
         # add sample to newest (left side)
         self._samples.appendleft(sample)
+        # keep running sum up to date
+        self._sum += temp
 
     def data_analysis(self):
         """Compute current average and other data analysis."""
         # this method should be called every minute
         # do nothing if there are no samples
-        if len(self._samples) == 0:
+        if not self._samples:
             return
+        # current time used by alarm handling
+        now = time.time()
         # get time of newest temperature sample
         last_time = self._samples[0][0]
         # remove samples that are too old (24 hours) from right side of queue
-        while (len(self._samples_1min) > 0 and 
-            last_time - self._samples_1min[-1][0] >= 24 * 60 * 60 - 30):
-            self._samples_1min.pop()
-        # compute the 1 minute average
-        average = 0.0
-        for sample in self._samples:
-            average += sample[1] # 1 is temperature
-        average /= len(self._samples)
+        if (self._samples_1min and 
+            last_time - self._samples_1min[0][0] >= WINDOW_24HR):
+            # even the newest sample is too old (e.g. after a long power
+            #   outage), drop them all at once
+            self._samples_1min.clear()
+        while (self._samples_1min and 
+            last_time - self._samples_1min[-1][0] >= WINDOW_24HR):
+            self._sum_1min -= self._samples_1min.pop()[1]
+        # an empty queue resets the running sum to avoid drift
+        if not self._samples_1min:
+            self._sum_1min = 0.0
+        # compute the 1 minute average from the running sum
+        average = self._sum / len(self._samples)
         # create the next sample
-        sample = [last_time, average]
+        sample = (last_time, average)
+        # a full queue drops its oldest sample when appending
+        if len(self._samples_1min) == SAMPLES_1MIN_MAX:
+            self._sum_1min -= self._samples_1min[-1][1]
         # add sample to newest (left side)
         self._samples_1min.appendleft(sample)
+        # keep running sum up to date
+        self._sum_1min += average
+        # number of 1 minute samples (never 0 at this point)
+        n1m = len(self._samples_1min)
         # compute delta using 1 minute samples
-        if (len(self._samples_1min) > 1):
-            # get the most recent sample time (in minutes) and temperature
-            latest_time = sample[0] / 60.0
-            latest_sample = sample[1]
-            # get the 2nd most recent sample time (in minutes) and temperature
-            prev_time = self._samples_1min[1][0] / 60.0
-            prev_sample = self._samples_1min[1][1]
-            # compute the most recent delta
-            self._delta = ((latest_sample - prev_sample) /
-                           (latest_time - prev_time))
+        if n1m > 1:
+            # the most recent sample is still in last_time and average
+            # get the 2nd most recent sample time and temperature
+            prev_time, prev_sample = self._samples_1min[1]
+            # compute the most recent delta (°C/min)
+            self._delta = ((average - prev_sample) * 60.0 /
+                           (last_time - prev_time))
         else:
             self._delta = float('nan')
-         # compute the 24 hour average
-        self._avg_24hr = 0.0
-        for sample in self._samples_1min:
-            self._avg_24hr += sample[1]
-        self._avg_24hr /= len(self._samples_1min)
+        # compute the 24 hour average from the running sum
+        self._avg_24hr = self._sum_1min / n1m
         # handle door open
         if self._open:
             # door was previously open, 
             if self._delta < self._delta_rise - 0.5:
                 # delta is below the closed threshold (delta_rise - 0.5)
                 self._open = False
-                logging.info("%s door closed.", self._name)
         else:
             # door was previously closed
             if self._delta >= self._delta_rise:
                 self._open = True
-                logging.info("%s door open.", self._name)
-        # handle alarm
-        if self.temperature >= self._alarm_max_temp:
+        # handle alarm, the 1 minute queue always has the new sample here
+        temp_now = self._samples_1min[0][1]
+        if temp_now >= self._alarm_max_temp:
             # we have exceeded the maximum temperature, instant alarm
             self._alarm = True
         if not self._alarm:
             # no alarm in progress
-            if self.temperature >= self._alarm_set_temp:
+            if temp_now >= self._alarm_set_temp:
                 # we are above alarm set temp
                 if self._alarm_time == 0:
                     # just went above alarm set temp
-                    self._alarm_time = datetime.now().timestamp()
+                    self._alarm_time = now
                 else:
                     # we are waiting for alarm set time to pass
-                    if (datetime.now().timestamp() - self._alarm_time >= 
-                    self._alarm_set_time * 60.0):
+                    if now - self._alarm_time >= self._alarm_set_seconds:
                         # we have been above alarm set time long enough
                         self._alarm = True
             else:
@@ -194,7 +233,7 @@ class TempData:
                 self._alarm_time = 0
         else:
             # alarm is in progress
-            if self.temperature <= self._alarm_reset_temp:
+            if temp_now <= self._alarm_reset_temp:
                 # alarm is now inactive
                 self._alarm =  False
                 # alarm time should be reset when alarm is deactivated
@@ -211,39 +250,41 @@ class TempData:
         if self._file_name != "":
             filename = self._file_name
         with open(filename, 'wb') as outFile:
-            pickle.dump(self._avg_24hr, outFile)
-            pickle.dump(self._delta, outFile)
-            pickle.dump(self._samples_1min, outFile)
+            pickle.dump((self._avg_24hr, self._delta, self._samples_1min), 
+                outFile, protocol=pickle.HIGHEST_PROTOCOL)
         
     def load_file(self, filename=None):
         """Load current state from file."""
+        if self._file_name != "":
+            filename = self._file_name
+        # start with no data, which is kept if the file fails to load
+        self._clear()
         try:
-            if self._file_name != "":
-                filename = self._file_name
             with open(filename, 'rb') as inFile:
-                self._avg_24hr = pickle.load(inFile)
-                self._delta = pickle.load(inFile)
-                self._samples_1min = pickle.load(inFile)
-            self._samples = deque()
-            self._noisy = 0
-            self._open = False
-            self._alarm = False
-            logging.info("Loaded %s data file.", filename)
-            return
+                data = pickle.load(inFile)
+                if not isinstance(data, tuple):
+                    # older files pickled each value separately
+                    data = (data, pickle.load(inFile), pickle.load(inFile))
+            avg_24hr, delta, samples_1min = data
+            # bound loaded queue keeping the newest (left side) samples
+            samples_1min = deque(
+                itertools.islice(samples_1min, SAMPLES_1MIN_MAX),
+                maxlen=SAMPLES_1MIN_MAX)
+            # running sum of loaded 1 minute samples
+            sum_1min = sum(map(itemgetter(1), samples_1min))
         except FileNotFoundError:
             # file not found is not an error
-            pass
-        except:
-            # log all other errors
+            return
+        except Exception:
+            # corrupt data can raise almost anything, log it and start
+            #   with no data
             logging.exception("Error, unable to load file %s.", filename)
-        # initialize the object 
-        self._samples = deque()
-        self._samples_1min = deque()
-        self._avg_24hr = float('nan')
-        self._delta = float('nan')
-        self._noisy = 0
-        self._open = False
-        self._alarm = False
+            return
+        self._avg_24hr = avg_24hr
+        self._delta = delta
+        self._samples_1min = samples_1min
+        self._sum_1min = sum_1min
+        logging.info("Loaded %s data file.", filename)
 
     @property
     def name(self):
@@ -253,7 +294,7 @@ class TempData:
     @property
     def temperature(self):
         """Get the last 1 minute temperature."""
-        if len(self._samples_1min) > 0:
+        if self._samples_1min:
             return self._samples_1min[0][1]
         else:
             return float('nan')
@@ -10,19 +10,28 @@ logger = logging.getLogger(__name__)
 
 
 class InfiniteTimer(threading.Thread):
-    """A Timer class that does not stop."""
+    """A Timer class that does not stop until stop() is called."""
 
     def __init__(self, t, f, group=None, target=None, name=None):
         threading.Thread.__init__(self, group=group, target=target, name=name)
         self.daemon = True
         self.t = t
         self.f = f
+        self._stop_event = threading.Event()
 
     def run(self):
-        starttime = time.time()
-        while True:
+        # monotonic clock is not affected by wall clock (NTP) changes
+        starttime = time.monotonic()
+        while not self._stop_event.is_set():
             self.f()
-            # figure out how much sleep remains, after f() was executed
-            delay = self.t - ((time.time() - starttime) % self.t)
+            # figure out how much wait remains, after f() was executed
+            delay = self.t - ((time.monotonic() - starttime) % self.t)
             # logger.debug("Delay: {}".format(delay))
-            time.sleep(delay)
+            self._stop_event.wait(delay)
+
+    def stop(self):
+        """Stop the timer once the current call to f() returns.
+            Returns immediately, callers that need f() to have finished
+            must join() the thread afterwards.
+        """
+        self._stop_event.set()
@@ -30,10 +30,13 @@
 """
     This module provides a temperature sensor of type w1 therm.
 """
+from concurrent.futures import ThreadPoolExecutor
 import logging
 import math
-from os import path, listdir, system, environ
-from time import sleep
+import os
+from os import path, listdir, scandir, environ
+import subprocess
+from time import sleep, monotonic
 
 
 class W1ThermSensorError(Exception):
@@ -73,6 +76,136 @@ class SensorFaultError(W1ThermSensorError):
         super(SensorFaultError, self).__init__("Sensor presented a fault condition when read")
 
 
+# hex pair as printed in the slave file to its byte value
+_HEX2 = {b"%02x" % i: i for i in range(256)}
+_HEX2.update({b"%02X" % i: i for i in range(256)})
+
+# NIST K-Type thermocouple coefficients, lowest order first
+#   see https://srdata.nist.gov/its90/download/type_k.tab
+# temperature to voltage, range -270°C to 0°C
+NIST_K_T2V_NEG = (
+     0.000000000000E+00,
+     0.394501280250E-01,
+     0.236223735980E-04,
+    -0.328589067840E-06,
+    -0.499048287770E-08,
+    -0.675090591730E-10,
+    -0.574103274280E-12,
+    -0.310888728940E-14,
+    -0.104516093650E-16,
+    -0.198892668780E-19,
+    -0.163226974860E-22,
+)
+# temperature to voltage, range 0°C to 1372°C
+NIST_K_T2V_POS = (
+    -0.176004136860E-01,
+     0.389212049750E-01,
+     0.185587700320E-04,
+    -0.994575928740E-07,
+     0.318409457190E-09,
+    -0.560728448890E-12,
+     0.560750590590E-15,
+    -0.320207200030E-18,
+     0.971511471520E-22,
+    -0.121047212750E-25,
+)
+# temperature to voltage exponential constants, range 0°C to 1372°C
+NIST_K_T2V_POS_EXP = (
+     0.118597600000E+00,
+    -0.118343200000E-03,
+     0.126968600000E+03,
+)
+# voltage to temperature (inverse), range -270°C to 0°C
+NIST_K_V2T_NEG = (
+     0.0000000E+00,
+     2.5173462E+01,
+    -1.1662878E+00,
+    -1.0833638E+00,
+    -8.9773540E-01,
+    -3.7342377E-01,
+    -8.6632643E-02,
+    -1.0450598E-02,
+    -5.1920577E-04,
+)
+# voltage to temperature (inverse), range 0°C to 500°C
+NIST_K_V2T_LOW = (
+     0.000000E+00,
+     2.508355E+01,
+     7.860106E-02,
+    -2.503131E-01,
+     8.315270E-02,
+    -1.228034E-02,
+     9.804036E-04,
+    -4.413030E-05,
+     1.057734E-06,
+    -1.052755E-08,
+)
+# voltage to temperature (inverse), range 500°C to 1372°C
+NIST_K_V2T_HIGH = (
+    -1.318058E+02,
+     4.830222E+01,
+    -1.646031E+00,
+     5.464731E-02,
+    -9.650715E-04,
+     8.802193E-06,
+    -3.110810E-08,
+)
+
+
+def _linearize_max31850k(Traw, Tcj):
+    """
+    Returns the NIST linearized Type K thermocouple temperature from the raw
+    MAX31850K thermocouple and cold junction temperatures.
+
+    :param float Traw: the raw thermocouple temperature in °C
+    :param float Tcj: the cold junction temperature in °C
+
+    :returns: the linearized thermocouple temperature in °C
+    :rtype: float
+    """
+    # NIST K-Type thermocouple linearization
+    # see https://srdata.nist.gov/its90/download/type_k.tab
+    # also 
+    # first calculate cold junction equivalent thermocouple voltage from
+    #   cold junction temperature using NIST temp to voltage coefficients
+    if Tcj < 0.0:
+        # range -270°C to 0°C
+        Vcj = 0.0
+        for c in reversed(NIST_K_T2V_NEG):
+            Vcj = Vcj * Tcj + c
+    else:
+        # range 0°C to 1372°C, includes an exponential term
+        Vcj = 0.0
+        for c in reversed(NIST_K_T2V_POS):
+            Vcj = Vcj * Tcj + c
+        a0, a1, a2 = NIST_K_T2V_POS_EXP
+        Vcj += a0 * math.exp(a1 * (Tcj - a2) * (Tcj - a2))
+    # calculate thermocouple voltage using MAX31855's 𝝻V/°C for K-Type 
+    #   thermocouple (see Table 1 of MAX31855 datasheet)
+    Vt = 0.041276 * (Traw - Tcj)
+    # add the linearized cold junction equivalent thermocouple voltage 
+    #   to thermocouple voltage (mV)
+    Vtotal = Vt + Vcj
+    # calculate linearized thermocouple temperature from Vtotal using
+    #   NIST voltage-to-temperature (inverse) coefficients
+    #   coefficent set to use (out of three) is determined by Vtotal
+    #   which is effectively linearized temperature
+    if Vtotal < 0.0:
+        # range -270°C to 0°C
+        d = NIST_K_V2T_NEG
+    elif Vtotal < 20.644: 
+        # range 0°C to 500°C
+        d = NIST_K_V2T_LOW
+    else:
+        # range 500°C to 1372°C
+        d = NIST_K_V2T_HIGH
+    # time to compute linearized thermocouple temperature
+    Tt = 0.0
+    for k in reversed(d):
+        Tt = Tt * Vtotal + k
+    return Tt
+
+
 def load_kernel_modules():
     """
     Load kernel modules needed by the temperature sensor
@@ -83,8 +216,13 @@ def load_kernel_modules():
     :raises KernelModuleLoadError: if the kernel module could not be loaded properly
     """
     if not path.isdir(W1ThermSensor.BASE_DIRECTORY):
-        system("modprobe w1-gpio >/dev/null 2>&1")
-        system("modprobe w1-therm >/dev/null 2>&1")
+        for module in ("w1-gpio", "w1-therm"):
+            try:
+                subprocess.run(["modprobe", module],
+                    stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            except OSError:
+                # modprobe is missing, the directory check below will fail
+                pass
 
     for _ in range(W1ThermSensor.RETRY_ATTEMPTS):
         if path.isdir(W1ThermSensor.BASE_DIRECTORY):  # w1 therm modules loaded correctly
@@ -102,19 +240,24 @@ class W1ThermSensor(object):
     THERM_SENSOR_DS1825 = 0x3B
     THERM_SENSOR_DS28EA00 = 0x42
     THERM_SENSOR_MAX31850K = 0x3B
-    ALL_TYPES = [
+    # DS1825 and MAX31850K share family code 0x3B, list it once
+    ALL_TYPES = (
         THERM_SENSOR_DS18S20, THERM_SENSOR_DS1822, THERM_SENSOR_DS18B20,
-        THERM_SENSOR_DS1825, THERM_SENSOR_DS28EA00, THERM_SENSOR_MAX31850K
-    ]
+        THERM_SENSOR_MAX31850K, THERM_SENSOR_DS28EA00
+    )
     DEGREES_C = 0x01
     DEGREES_F = 0x02
     KELVIN = 0x03
     BASE_DIRECTORY = "/sys/bus/w1/devices"
     SLAVE_FILE = "w1_slave"
+    BUS_MASTER_PREFIX = "w1_bus_master"
+    BULK_READ_FILE = "therm_bulk_read"
+    CACHE_TTL = 0.5
+    # (multiplier, offset) converting the raw millidegree Celsius value
     UNIT_FACTORS = {
-        DEGREES_C: lambda x: x * 0.001,
-        DEGREES_F: lambda x: x * 0.001 * 1.8 + 32.0,
-        KELVIN: lambda x: x * 0.001 + 273.15
+        DEGREES_C: (0.001, 0.0),
+        DEGREES_F: (0.001 * 1.8, 32.0),
+        KELVIN: (0.001, 273.15)
     }
     UNIT_FACTOR_NAMES = {
         "celsius": DEGREES_C,
@@ -131,6 +274,23 @@ class W1ThermSensor(object):
     }
     RETRY_ATTEMPTS = 10
     RETRY_DELAY_SECONDS = 1.0 / float(RETRY_ATTEMPTS)
+    _MODULES_LOADED = False
+    _BULK_READ_AVAILABLE = True
+
+    @classmethod
+    def _load_kernel_modules_once(cls):
+        """
+            Loads the kernel modules the first time a sensor is accessed.
+            Set the environment variable W1THERMSENSOR_NO_KERNEL_MODULE=1
+            to skip loading them.
+
+            :raises KernelModuleLoadError: if the w1 therm kernel modules could not be loaded correctly
+        """
+        if W1ThermSensor._MODULES_LOADED:
+            return
+        if environ.get('W1THERMSENSOR_NO_KERNEL_MODULE', '0') != '1':
+            load_kernel_modules()
+        W1ThermSensor._MODULES_LOADED = True
 
     @classmethod
     def get_available_sensors(cls, types=None):
@@ -143,12 +303,128 @@ class W1ThermSensor(object):
             :rtype: list
 
         """
+        return [cls(cls.RESOLVE_TYPE_STR[e.name[:2]], e.name[3:], _dir_entry=e)
+                for e in cls._scan_sensor_entries(types)]
+
+    @classmethod
+    def _scan_sensor_entries(cls, types=None):
+        """
+            Yields the directory entries of all available sensors.
+
+            :param list types: the types of the sensor to look for. If types is None it will search for all available types.
+        """
+        cls._load_kernel_modules_once()
         if not types:
             types = cls.ALL_TYPES
-        is_sensor = lambda s: any(s.startswith(hex(x)[2:]) for x in types)
-        return [cls(cls.RESOLVE_TYPE_STR[s[:2]], s[3:]) for s in listdir(cls.BASE_DIRECTORY) if is_sensor(s)]
+        # family codes as they appear in the slave directory names
+        prefixes = frozenset("%02x" % x for x in types)
+        with scandir(cls.BASE_DIRECTORY) as entries:
+            for e in entries:
+                if e.name[:2] in prefixes and e.name[2:3] == "-":
+                    yield e
 
-    def __init__(self, sensor_type=None, sensor_id=None):
+    @classmethod
+    def _scan_first_sensor_id(cls, types=None):
+        """
+            Returns the type and id of the first available sensor without
+            constructing any sensor instances.
+
+            :param list types: the types of the sensor to look for. If types is None it will search for all available types.
+
+            :returns: the sensor type and id or None if no sensor was found
+            :rtype: tuple
+        """
+        for e in cls._scan_sensor_entries(types):
+            return cls.RESOLVE_TYPE_STR[e.name[:2]], e.name[3:]
+        return None
+
+    @classmethod
+    def trigger_bulk_read(cls):
+        """
+            Triggers a simultaneous temperature conversion on all sensors of
+            every bus master that supports the kernel bulk read interface. The
+            kernel waits for the conversion to complete before the write
+            returns. Sensors read afterwards return the converted temperature
+            without starting a new conversion.
+
+            If no bus master could be triggered the failure is remembered and
+            later calls return immediately.
+
+            :returns: True if a conversion was triggered, False if no bus master
+            supports bulk read (or it could not be written).
+            :rtype: bool
+        """
+        if not W1ThermSensor._BULK_READ_AVAILABLE:
+            return False
+        cls._load_kernel_modules_once()
+        triggered = False
+        for master in listdir(cls.BASE_DIRECTORY):
+            if not master.startswith(cls.BUS_MASTER_PREFIX):
+                continue
+            bulk_path = path.join(cls.BASE_DIRECTORY, master, cls.BULK_READ_FILE)
+            try:
+                with open(bulk_path, "w") as f:
+                    f.write("trigger\n")
+                triggered = True
+            except PermissionError:
+                logging.warning("Bulk read disabled, no write permission "
+                    "for %s.", bulk_path)
+            except IOError:
+                # not supported by this kernel
+                pass
+        if not triggered:
+            # don't retry on every read cycle
+            W1ThermSensor._BULK_READ_AVAILABLE = False
+        return triggered
+
+    @classmethod
+    def read_all(cls, sensors, unit=DEGREES_C):
+        """
+            Returns the temperatures of the given sensors after triggering a
+            single bulk conversion on all bus masters.
+
+            :param list sensors: the sensors to read
+            :param int unit: the unit of the temperatures requested
+
+            :returns: the sensor temperatures in the given unit. The order of
+            the temperatures matches the order of the given sensors.
+            :rtype: list
+
+            :raises UnsupportedUnitError: if the unit is not supported
+            :raises NoSensorFoundError: if a sensor could not be found
+            :raises SensorNotReadyError: if a sensor is not ready yet
+        """
+        cls.trigger_bulk_read()
+        for sensor in sensors:
+            # results from before the conversion are stale
+            sensor.clear_cache()
+        return [sensor.get_temperature(unit) for sensor in sensors]
+
+    @classmethod
+    def read_many(cls, sensors, unit=DEGREES_C):
+        """
+            Returns the temperatures of the given sensors, reading them
+            concurrently. Only sensors on different bus masters benefit since
+            the kernel serializes access to each bus.
+
+            :param list sensors: the sensors to read
+            :param int unit: the unit of the temperatures requested
+
+            :returns: the sensor temperatures in the given unit. The order of
+            the temperatures matches the order of the given sensors.
+            :rtype: list
+
+            :raises UnsupportedUnitError: if the unit is not supported
+            :raises NoSensorFoundError: if a sensor could not be found
+            :raises SensorNotReadyError: if a sensor is not ready yet
+        """
+        if not sensors:
+            return []
+        with ThreadPoolExecutor(max_workers=len(sensors)) as executor:
+            return list(executor.map(
+                lambda sensor: sensor.get_temperature(unit), sensors))
+
+    def __init__(self, sensor_type=None, sensor_id=None, _dir_entry=None):
         """
             Initializes a W1ThermSensor.
             If the W1ThermSensor base directory is not found it will automatically load
@@ -159,33 +435,64 @@ class W1ThermSensor(object):
 
             :param int sensor_type: the type of the sensor.
             :param string id: the id of the sensor.
+            :param DirEntry _dir_entry: internal, the directory entry of a
+            sensor just found by get_available_sensors.
 
             :raises KernelModuleLoadError: if the w1 therm kernel modules could not be loaded correctly
             :raises NoSensorFoundError: if the sensor with the given type and/or id does not exist or is not connected
         """
+        # slave file kept open between reads, see below
+        self._fd = None
+        self._load_kernel_modules_once()
         self.type = sensor_type
         self.id = sensor_id
         if not sensor_type and not sensor_id:  # take first found sensor
             for _ in range(self.RETRY_ATTEMPTS):
-                s = self.get_available_sensors()
-                if s:
-                    self.type, self.id = s[0].type, s[0].id
+                found = self._scan_first_sensor_id()
+                if found:
+                    self.type, self.id = found
                     break
                 sleep(self.RETRY_DELAY_SECONDS)
             else:
                 raise NoSensorFoundError(None, "")
         elif not sensor_id:
-            s = self.get_available_sensors([sensor_type])
-            if not s:
+            found = self._scan_first_sensor_id([sensor_type])
+            if not found:
                 raise NoSensorFoundError(sensor_type, "")
-            self.id = s[0].id
+            self.id = found[1]
 
-        # store path to sensor
-        self.sensorpath = path.join(self.BASE_DIRECTORY, self.slave_prefix + self.id, self.SLAVE_FILE)
+        # store slave directory prefix and path to sensor
+        self._slave_prefix = "%02x-" % self.type
+        self.sensorpath = path.join(self.BASE_DIRECTORY, self._slave_prefix + self.id, self.SLAVE_FILE)
 
-        if not self.exists():
+        # a sensor found by directory scan is known to exist
+        if _dir_entry is None and not self.exists():
             raise NoSensorFoundError(self.type, self.id)
 
+        # last slave file contents and when they were read
+        self._cache_data = None
+        self._cache_time = 0.0
+        # bind the reader for this sensor type once
+        if self.type == self.THERM_SENSOR_MAX31850K:
+            self._read_raw = self._read_max31850k
+            # the thermocouple is read every sample, keep its slave file
+            #   open and rewind it instead of reopening it for each read
+            try:
+                self._fd = os.open(self.sensorpath, os.O_RDONLY)
+            except OSError:
+                raise NoSensorFoundError(self.type, self.id)
+        else:
+            self._read_raw = self._read_ds18x20
+
+    def __del__(self):
+        self.close()
+
+    def close(self):
+        """Closes the slave file if it is being kept open"""
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
     def __repr__(self):
         """
             Returns a string that eval can turn back into this object
@@ -214,12 +521,53 @@ class W1ThermSensor(object):
     @property
     def slave_prefix(self):
         """Returns the slave prefix for this temperature sensor"""
-        return "%s-" % hex(self.type)[2:]
+        return self._slave_prefix
 
     def exists(self):
         """Returns the sensors slave path"""
         return path.exists(self.sensorpath)
 
+    def _read_slave_file(self):
+        """
+            Returns the contents of the slave file, reusing the previous read
+            if it is less than CACHE_TTL seconds old.
+
+            :returns: the raw contents of the slave file
+            :rtype: bytes
+
+            :raises NoSensorFoundError: if the sensor could not be found
+        """
+        if (self._cache_data is not None and
+                monotonic() - self._cache_time < self.CACHE_TTL):
+            return self._cache_data
+        try:
+            # the file is tiny, a single read returns all of it
+            if self._fd is not None:
+                # sysfs regenerates the contents when read from the start
+                os.lseek(self._fd, 0, os.SEEK_SET)
+                data = os.read(self._fd, 256)
+            else:
+                fd = os.open(self.sensorpath, os.O_RDONLY)
+                try:
+                    data = os.read(fd, 256)
+                finally:
+                    os.close(fd)
+        except OSError:
+            # sensor went away, fall back to opening the file on each read
+            self.close()
+            raise NoSensorFoundError(self.type, self.id)
+        # only cache reads that passed the CRC check so a retry after
+        #   SensorNotReadyError reads the sensor again
+        if data.partition(b"\n")[0].endswith(b"YES"):
+            # the read blocks for the conversion, age the cache from its end
+            self._cache_data = data
+            self._cache_time = monotonic()
+        return data
+
+    def clear_cache(self):
+        """Forces the next read to fetch fresh data from the sensor"""
+        self._cache_data = None
+
     @property
     def raw_sensor_value(self):
         """
@@ -231,19 +579,17 @@ class W1ThermSensor(object):
             :raises NoSensorFoundError: if the sensor could not be found
             :raises SensorNotReadyError: if the sensor is not ready yet
         """
-        if self.type == 0x3b:
-            # MAX31850k is treated differently
-            return self.raw_max31850k_value
-        # all other sensors are treated the same way
-        try:
-            with open(self.sensorpath, "r") as f:
-                data = f.readlines()
-        except IOError:
-            raise NoSensorFoundError(self.type, self.id)
+        return self._read_raw()
 
-        if data[0].strip()[-3:] != "YES":
+    def _read_ds18x20(self):
+        """Returns the raw value of any sensor other than the MAX31850K"""
+        data = self._read_slave_file()
+        # first line ends with the CRC check, second line holds the value
+        line, _, value = data.partition(b"\n")
+
+        if not line.endswith(b"YES"):
             raise SensorNotReadyError()
-        return float(data[1].split("=")[1])
+        return float(value.rpartition(b"=")[2])
 
     @property
     def raw_max31850k_value(self):
@@ -261,182 +607,40 @@ class W1ThermSensor(object):
             :raises SensorNotReadyError: if the sensor is not ready yet
             :raises SensorFaultError : if the sensor read reported a fault
         """
-        try:
-            with open(self.sensorpath, "r") as f:
-                data = f.readlines()
-        except IOError:
-            raise NoSensorFoundError(self.type, self.id)
+        return self._read_max31850k()
+
+    def _read_max31850k(self):
+        """Returns the linearized MAX31850K value, see raw_max31850k_value"""
+        data = self._read_slave_file()
 
-        if data[0].strip()[-3:] != "YES":
+        if not data.partition(b"\n")[0].endswith(b"YES"):
             raise SensorNotReadyError()
         
-        dataASCIIBytes = data[0].split(" ")
+        # parse the nine scratchpad bytes once, each hex pair is at a fixed
+        #   offset in the first line
+        scratchpad = [_HEX2[data[i:i + 2]] for i in range(0, 27, 3)]
 
         # check for faults
-        if int(dataASCIIBytes[0], 16) & 0x1 == 0x01:
+        if scratchpad[0] & 0x1 == 0x01:
             raise SensorFaultError()
 
         # get MAX31850 the raw thermocouple temperature in Celsius
-        Traw = int(dataASCIIBytes[1], 16) << 6
-        Traw += int(dataASCIIBytes[0], 16) >> 2
-        # convert sign/magnitude to 2's complement with sign at bit 14
-        if (Traw & (1 << (14 - 1))) != 0:
-            Traw = Traw - (1 << 14)
+        Traw = scratchpad[1] << 6
+        Traw += scratchpad[0] >> 2
+        # sign extend the 14-bit 2's complement value
+        Traw = (Traw ^ 0x2000) - 0x2000
         # convert fixed point to float
         Traw /= 4.0
 
         # get MAX31850 cold junction temperature in Celsius
-        Tcj = int(dataASCIIBytes[3], 16) << 4
-        Tcj += int(dataASCIIBytes[2], 16) >> 4
-        # convert sign/magnitude to 2's complement with sign at bit 12
-        if (Tcj & (1 << (12 - 1))) != 0:
-            Tcj = Tcj - (1 << 12)
+        Tcj = scratchpad[3] << 4
+        Tcj += scratchpad[2] >> 4
+        # sign extend the 12-bit 2's complement value
+        Tcj = (Tcj ^ 0x800) - 0x800
         # convert fixed point to float
         Tcj /= 16.0
 
-        # NIST K-Type thermocouple linearization
-        # see https://srdata.nist.gov/its90/download/type_k.tab
-        # also 
-        # first calculate cold junction equivalent thermocouple voltage from
-        #   cold junction temperature using NIST temp to voltage coefficients
-        if Tcj < 0.0:
-            # range -270°C to 0°C
-            c = [
-                 0.000000000000E+00,
-                 0.394501280250E-01,
-                 0.236223735980E-04,
-                -0.328589067840E-06,
-                -0.499048287770E-08,
-                -0.675090591730E-10,
-                -0.574103274280E-12,
-                -0.310888728940E-14,
-                -0.104516093650E-16,
-                -0.198892668780E-19,
-                -0.163226974860E-22,
-            ]
-            # time to compute cold junction equivalent thermocouple voltage
-            Vcj = 0.0
-            for i in range(0, len(c)):
-                Vcj += c[i] * math.pow(Tcj, i)
-        else:
-            # range 0°C to 1372°C
-            # coefficients
-            c = [
-                -0.176004136860E-01,
-                 0.389212049750E-01,
-                 0.185587700320E-04,
-                -0.994575928740E-07,
-                 0.318409457190E-09,
-                -0.560728448890E-12,
-                 0.560750590590E-15,
-                -0.320207200030E-18,
-                 0.971511471520E-22,
-                -0.121047212750E-25,
-            ]
-            # exponential constants
-            a = [
-                 0.118597600000E+00,
-                -0.118343200000E-03,
-                 0.126968600000E+03,
-            ]
-            # time to compute linearized cold junction equivalent 
-            #   thermocouple voltage
-            Vcj = 0.0
-            for i in range(0, len(c)):
-                Vcj += c[i] * math.pow(Tcj, i)
-            Vcj += a[0] * math.exp(a[1] * math.pow((Tcj-a[2]), 2.0))
-        # calculate thermocouple voltage using MAX31855's 𝝻V/°C for K-Type 
-        #   thermocouple (see Table 1 of MAX31855 datasheet)
-        Vt = 0.041276 * (Traw - Tcj)
-        # add the linearized cold junction equivalent thermocouple voltage 
-        #   to thermocouple voltage (mV)
-        Vtotal = Vt + Vcj
-        # calculate linearized thermocouple temperature from Vtotal using
-        #   NIST voltage-to-temperature (inverse) coefficients
-        #   coefficent set to use (out of three) is determined by Vtotal
-        #   which is effectively linearized temperature
-        if Vtotal < 0.0:
-            # range -270°C to 0°C
-            d = [
-                 0.0000000E+00,
-                 2.5173462E+01,
-                -1.1662878E+00,
-                -1.0833638E+00,
-                -8.9773540E-01,
-                -3.7342377E-01,
-                -8.6632643E-02,
-                -1.0450598E-02,
-                -5.1920577E-04,
-            ]
-        elif Vtotal < 20.644: 
-            # range 0°C to 500°C
-            d = [
-                 0.000000E+00,
-                 2.508355E+01,
-                 7.860106E-02,
-                -2.503131E-01,
-                 8.315270E-02,
-                -1.228034E-02,
-                 9.804036E-04,
-                -4.413030E-05,
-                 1.057734E-06,
-                -1.052755E-08,
-            ]
-        else:
-            # range 500°C to 1372°C
-            d = [
-                -1.318058E+02,
-                 4.830222E+01,
-                -1.646031E+00,
-                 5.464731E-02,
-                -9.650715E-04,
-                 8.802193E-06,
-                -3.110810E-08,
-            ]
-        # time to compute linearized thermocouple temperature
-        Tt = 0.0
-        for i in range(0, len(d)):
-            Tt += d[i] * math.pow(Vtotal, i)
-
-        # # rational polynomial function approximation linearizations for
-        # #   K-Type  thermocouples with a temperature range of -100°C to 100°C
-        # #   see http://www.mosaic-industries.com/embedded-systems/
-        # #       microcontroller-projects/temperature-measurement/
-        # #       thermocouple/type-k-calibration-table
-        # # first get cold junction voltage from cold junction temperature
-        # #   cold temperature junction range of -20°C to 70°C
-        # T0 =  2.5000000E+01
-        # V0 =  1.0003453E+00
-        # p1 =  4.0514854E-02
-        # p2 = -3.8789638E-05
-        # p3 = -2.8608478E-06
-        # p4 = -9.5367041E-10
-        # q1 = -1.3948675E-03
-        # q2 = -6.7976627E-05
-        # a = Tcj - T0
-        # VcjNew = (V0 + a*(p1 + a*(p2 + a*(p3 + p4*a))) / (1 + a*(q1 + q2*a)))
-        # # linearize thermocouple temperature
-        # T0 = -8.7935962E+00
-        # V0 = -3.4489914E-01
-        # p1 =  2.5678719E+01
-        # p2 = -4.9887904E-01
-        # p3 = -4.4705222E-01
-        # p4 = -4.4869203E-02
-        # q1 =  2.3893439E-04
-        # q2 = -2.0397750E-02
-        # q3 = -1.8424107E-03
-        # # cold junction voltage + thermocouple voltage
-        # totalVoltage = 0.041276 * (Traw - Tcj) + VcjNew
-        # # intermediate sum for equation below
-        # a = totalVoltage - V0
-        # # linearize thermocouple measurement
-        # TtNew = (T0 + a*(p1 + a*(p2 + a*(p3 + p4*a))) /
-        #             (1 + a*(q1 + a)*(q2 + q3*a)))
-        # logging.debug(f"Vcj={Vcj}, VcjNew={VcjNew}")
-        # logging.debug(f"Tt={Tt:0.6F}, TtNew={TtNew:0.6F}, " +
-        #     f"Traw={Traw:0.2F}, Tcj={Tcj:0.2F}")
-
-        return Tt * 1000.0
+        return _linearize_max31850k(Traw, Tcj) * 1000.0
         
     def get_max31850k_address(self):
         """
@@ -453,18 +657,14 @@ class W1ThermSensor(object):
         if self.type != 0x3b:
             raise NoSensorFoundError(self.type, self.id)
         # reading temperature will read the entire scratchpad
-        try:
-            with open(self.sensorpath, "r") as f:
-                data = f.readlines()
-        except IOError:
-            raise NoSensorFoundError(self.type, self.id)
+        data = self._read_slave_file()
 
         # make sure sensor is ready
-        if data[0].strip()[-3:] != "YES":
+        if not data.partition(b"\n")[0].endswith(b"YES"):
             raise SensorNotReadyError()
-        dataASCIIBytes = data[0].split(" ")
 
-        return int(dataASCIIBytes[4], 16) & 0x0F
+        # scratchpad byte 4 is at a fixed offset in the first line
+        return _HEX2[data[12:14]] & 0x0F
         
     @classmethod
     def _get_unit_factor(cls, unit):
@@ -473,8 +673,9 @@ class W1ThermSensor(object):
 
             :param int unit: the unit of the factor requested
 
-            :returns: a function to convert the raw sensor value to the given unit
-            :rtype: lambda function
+            :returns: the multiplier and offset to convert the raw sensor value
+            to the given unit
+            :rtype: tuple
 
             :raises UnsupportedUnitError: if the unit is not supported
         """
@@ -498,8 +699,8 @@ class W1ThermSensor(object):
             :raises NoSensorFoundError: if the sensor could not be found
             :raises SensorNotReadyError: if the sensor is not ready yet
         """
-        factor = self._get_unit_factor(unit)
-        return factor(self.raw_sensor_value)
+        factor, offset = self._get_unit_factor(unit)
+        return self.raw_sensor_value * factor + offset
 
     def get_temperatures(self, units):
         """
@@ -516,11 +717,5 @@ class W1ThermSensor(object):
             :raises SensorNotReadyError: if the sensor is not ready yet
         """
         sensor_value = self.raw_sensor_value
-        return [self._get_unit_factor(unit)(sensor_value) for unit in units]
-
-
-# Load kernel modules automatically upon import.
-# Set the environment variable W1THERMSENSOR_NO_KERNEL_MODULE=1
-
-if environ.get('W1THERMSENSOR_NO_KERNEL_MODULE', '0') != '1':
-    load_kernel_modules()
+        factors = [self._get_unit_factor(unit) for unit in units]
+        return [sensor_value * factor + offset for factor, offset in factors]